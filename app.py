@@ -1,21 +1,35 @@
 
+import math
+import hashlib
+from collections import namedtuple
+from urllib.parse import quote
 import streamlit as st
 import pandas as pd
 import numpy as np
+import shapely
+import diskcache
+from numba import njit
 import folium
 from streamlit_folium import st_folium
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
-from folium.plugins import MarkerCluster
+from geopy.exc import GeopyError
+from folium.plugins import FastMarkerCluster
 
 # ------------------ 기본 위치 설정 ------------------
 DEFAULT_LAT = 37.5665
 DEFAULT_LNG = 126.9780
 
 # ------------------ 데이터 로딩 ------------------
-@st.cache_data
-def load_data(xlsx_path: str) -> pd.DataFrame:
-    df = pd.read_excel(xlsx_path, engine="openpyxl")
+FILTER_COLUMNS = ["운영기관", "장소유형", "이용가능여부", "충전기타입", "충전속도"]
+
+# 읽기 전용 공유 데이터 (세션 간 하나의 인스턴스를 공유하므로 수정 시 반드시 복사)
+ChargerData = namedtuple("ChargerData", ["df", "lat_rad", "lon_rad", "cos_lat", "sindex"])
+
+@st.cache_resource
+def load_data(path: str) -> ChargerData:
+    # 원본 xlsx는 tools/xlsx_to_parquet.py로 미리 변환 (openpyxl 파싱이 매우 느림)
+    df = pd.read_parquet(path)
     if "위도경도" in df.columns:
         df[["위도", "경도"]] = df["위도경도"].str.split(",", expand=True).astype(float)
     df = (
@@ -29,53 +43,222 @@ def load_data(xlsx_path: str) -> pd.DataFrame:
             "시설구분(소)": "장소유형",
         })
         .dropna(subset=["위도", "경도"])
+        # 좌표는 float32(~1m 정밀도로 충분), 필터 컬럼은 범주형으로 저장해 메모리/대역폭 절감
+        .astype({"위도": np.float32, "경도": np.float32, **{c: "category" for c in FILTER_COLUMNS}})
     )
-    return df
+    df["_color"] = pd.Categorical(np.select(
+        [df["이용가능여부"].eq("이용가능"), df["이용가능여부"].eq("이용자제한")],
+        ["green", "orange"],
+        default="red",
+    ))
+    # 라디안/코사인 값은 검색마다 다시 계산하지 않도록 미리 저장
+    lat_rad = np.radians(df["위도"].to_numpy())
+    lon_rad = np.radians(df["경도"].to_numpy())
+    sindex = shapely.STRtree(shapely.points(df["경도"].to_numpy(), df["위도"].to_numpy()))
+    return ChargerData(df, lat_rad, lon_rad, np.cos(lat_rad), sindex)
 
 # ------------------ 거리 계산 ------------------
-def haversine_np(lon1, lat1, lon2, lat2):
-    R = 6371
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-    dlon, dlat = lon2 - lon1, lat2 - lat1
-    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
-    return 2 * R * np.arcsin(np.sqrt(a))
+R_KM = 6371.0
+
+@njit(fastmath=True, cache=True)
+def haversine_a_nb(lon_r, lat_r, cos_lat, lon0, lat0, out):
+    # Haversine의 a 항만 계산 (거리와 단조 관계이므로 반경 비교/정렬에는 a로 충분)
+    lon0, lat0 = math.radians(lon0), math.radians(lat0)
+    cos_lat0 = math.cos(lat0)
+    for i in range(lon_r.size):
+        out[i] = math.sin((lat_r[i] - lat0) / 2)**2 + cos_lat0 * cos_lat[i] * math.sin((lon_r[i] - lon0) / 2)**2
+    return out
+
+def radius_to_a(radius_km: float) -> float:
+    return math.sin(radius_km / (2 * R_KM))**2
+
+def a_to_km(a: np.ndarray) -> np.ndarray:
+    return 2 * R_KM * np.arcsin(np.sqrt(a))
+
+def dist_buffer(n: int) -> np.ndarray:
+    # 거리 결과용 버퍼를 세션에 두고 재사용 (검색마다 새로 할당하지 않음)
+    buf = st.session_state.get("dist_buf")
+    if buf is None or buf.size < n:
+        buf = np.empty(n, dtype=np.float64)
+        st.session_state["dist_buf"] = buf
+    return buf[:n]
+
+def bbox_candidates(sindex, lat, lon, radius_km):
+    # 반경을 감싸는 위경도 사각형 (1도 ≈ 111km) 으로 Haversine 대상 후보(행 위치)를 먼저 추림
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * math.cos(math.radians(lat)))
+    return np.sort(sindex.query(shapely.box(lon - dlon, lat - dlat, lon + dlon, lat + dlat)))
+
+# ------------------ 필터 ------------------
+def isin_codes(col: pd.Series, selected) -> np.ndarray:
+    # 문자열 비교 대신 범주형 정수 코드로 포함 여부 판정
+    codes = col.cat.categories.get_indexer(list(selected))
+    return np.isin(col.cat.codes.to_numpy(), codes[codes >= 0])
 
 # ------------------ 주소 → 좌표 ------------------
-def address_to_coords(address: str):
+GEOCACHE_TTL = 30 * 86400  # 디스크 지오코딩 캐시 보관 기간 (30일)
+
+@st.cache_resource
+def get_geocache():
+    return diskcache.Cache(".geocache")
+
+@st.cache_resource
+def get_geocoder():
+    # RateLimiter는 마지막 호출 시각을 기억하므로 한 번만 만들어 모든 호출이 공유해야 제한이 지켜짐
+    # 네트워크/서버 오류는 None으로 삼키지 않고 예외로 올려 "주소 없음"으로 캐시되지 않게 함
     geolocator = Nominatim(user_agent="ev_locator")
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-    loc = geocode(address)
-    return (loc.latitude, loc.longitude) if loc else (None, None)
+    return RateLimiter(geolocator.geocode, min_delay_seconds=1, swallow_exceptions=False)
+
+@st.cache_data(ttl=86400)
+def address_to_coords(address: str):
+    # 같은 주소는 Nominatim(1초 제한)을 다시 호출하지 않도록 디스크에 캐시
+    cache = get_geocache()
+    key = address.strip().lower()
+    coords = cache.get(key)
+    if coords is not None:
+        return coords
+    loc = get_geocoder()(address)
+    if loc is None:
+        return None, None
+    coords = (loc.latitude, loc.longitude)
+    cache.set(key, coords, expire=GEOCACHE_TTL)
+    return coords
+
+# ------------------ 지도 마커 ------------------
+# 팝업/길찾기 링크는 브라우저에서 템플릿으로 생성 (%(lat)s, %(lon)s 자리에 내 위치)
+# row: [위도, 경도, 충전소명, 주소, 충전기타입, 충전속도, 운영기관, 장소유형, 거리_km, 이용가능여부, 색상]
+MARKER_CALLBACK = """function (row) {
+    var html = `<b>${row[2]}</b><br>${row[3]}<br>
+        ⚡ 타입: ${row[4]}<br>
+        ⚡ 속도: ${row[5]}<br>
+        🏢 운영기관: ${row[6]}<br>
+        🗺 장소유형: ${row[7]}<br>
+        📍 거리: ${row[8].toFixed(2)} km<br>
+        ✅ 상태: ${row[9]}<br><br>
+        <a href='https://map.kakao.com/link/to/${encodeURIComponent(row[2])},${row[0]},${row[1]}' target='_blank'>🧭 카카오 길찾기</a><br>
+        <a href='https://map.naver.com/v5/directions/%(lat)s,%(lon)s/${row[0]},${row[1]}' target='_blank'>🧭 네이버 길찾기</a>`;
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({markerColor: row[10], icon: "bolt", prefix: "fa"})
+    });
+    marker.bindTooltip(row[2]);
+    marker.bindPopup(html, {maxWidth: 300});
+    return marker;
+}"""
+
+# 일반 마커 팝업 템플릿 (한 번만 만들어 두고 행 dict로 채움)
+POPUP_TMPL = (
+    "<b>{충전소명}</b><br>{주소}<br>"
+    "⚡ 타입: {충전기타입}<br>"
+    "⚡ 속도: {충전속도}<br>"
+    "🏢 운영기관: {운영기관}<br>"
+    "🗺 장소유형: {장소유형}<br>"
+    "📍 거리: {거리_km:.2f} km<br>"
+    "✅ 상태: {이용가능여부}<br><br>"
+    "<a href='https://map.kakao.com/link/to/{kakao_name},{위도},{경도}' target='_blank'>🧭 카카오 길찾기</a><br>"
+    "<a href='https://map.naver.com/v5/directions/{lat},{lon}/{위도},{경도}' target='_blank'>🧭 네이버 길찾기</a>"
+).format_map
+
+# 결과 수에 따라 렌더링 방식 선택:
+# PLAIN 미만은 일반 마커, CLUSTER 미만은 FastMarkerCluster, 그 이상은 GeoJSON 원형 마커
+PLAIN_MARKER_LIMIT = 50
+CLUSTER_MARKER_LIMIT = 2000
+# GeoJSON 속성 이름은 페이로드를 줄이기 위해 짧은 ASCII 키 사용 (팝업에는 별칭으로 표시)
+GEOJSON_FIELDS = {
+    "충전소명": "name", "주소": "addr", "충전기타입": "type", "충전속도": "speed",
+    "운영기관": "op", "장소유형": "place", "거리_km": "dist", "이용가능여부": "status",
+}
+GEOJSON_ALIASES = ["충전소", "주소", "⚡ 타입", "⚡ 속도", "🏢 운영기관", "🗺 장소유형", "📍 거리(km)", "✅ 상태"]
+
+def df_to_geojson(df: pd.DataFrame) -> dict:
+    coords = np.column_stack([df["경도"].to_numpy(np.float64), df["위도"].to_numpy(np.float64)]).tolist()
+    props = df[list(GEOJSON_FIELDS)].rename(columns=GEOJSON_FIELDS).to_dict("records")
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": xy}, "properties": p}
+            for xy, p in zip(coords, props)
+        ],
+    }
+
+def marker_payload(df: pd.DataFrame, lat: float, lon: float):
+    # 지도에 넘길 마커 데이터(팝업 HTML, 클러스터 행, GeoJSON)를 결과 수에 맞는 방식으로 생성
+    n = len(df)
+    if n == 0:
+        return "none", None
+    if n < PLAIN_MARKER_LIMIT:
+        # 소수의 결과는 클러스터 초기화 비용 없이 바로 마커로 표시
+        return "plain", [
+            (r.위도, r.경도, r.충전소명, r.색상,
+             POPUP_TMPL({**r._asdict(), "kakao_name": quote(r.충전소명), "lat": lat, "lon": lon}))
+            for r in df.rename(columns={"_color": "색상"}).itertuples(index=False)
+        ]
+    if n < CLUSTER_MARKER_LIMIT:
+        # 마커/팝업은 브라우저에서 생성 (행마다 folium.Marker를 만들지 않음)
+        data = list(df[[
+            "위도", "경도", "충전소명", "주소", "충전기타입", "충전속도",
+            "운영기관", "장소유형", "거리_km", "이용가능여부", "_color"
+        ]].itertuples(index=False, name=None))
+        return "cluster", (data, MARKER_CALLBACK % {"lat": lat, "lon": lon})
+    # 결과가 많으면 클러스터 대신 색상별 GeoJSON 원형 마커 레이어 하나씩으로 표시
+    df = df.assign(거리_km=df["거리_km"].round(2))
+    return "geojson", [(color, df_to_geojson(group)) for color, group in df.groupby("_color", observed=True)]
+
+def add_charger_markers(m: folium.Map, payload):
+    # folium 객체는 렌더링할 때마다 상태가 쌓이므로 지도마다 새로 만들고, 데이터만 재사용
+    kind, data = payload
+    if kind == "plain":
+        group = folium.FeatureGroup(name="충전소").add_to(m)
+        for r_lat, r_lon, name, color, html in data:
+            folium.Marker(
+                [r_lat, r_lon],
+                tooltip=name,
+                popup=folium.Popup(html, max_width=300),
+                icon=folium.Icon(color=color, icon="bolt", prefix="fa")
+            ).add_to(group)
+    elif kind == "cluster":
+        rows, callback = data
+        FastMarkerCluster(rows, callback=callback).add_to(m)
+    elif kind == "geojson":
+        for color, geojson in data:
+            folium.GeoJson(
+                geojson,
+                marker=folium.CircleMarker(radius=5, color=color, weight=1, fill=True, fill_color=color, fill_opacity=0.8),
+                tooltip=folium.GeoJsonTooltip(fields=["name"], labels=False),
+                popup=folium.GeoJsonPopup(fields=list(GEOJSON_FIELDS.values()), aliases=GEOJSON_ALIASES, max_width=300),
+            ).add_to(m)
+
+def map_cache_key(lat: float, lon: float, radius, df: pd.DataFrame) -> str:
+    # 중심 좌표·반경·결과 행 인덱스가 같으면 같은 마커 데이터
+    h = hashlib.md5(repr((lat, lon, radius)).encode())
+    h.update(df.index.to_numpy().tobytes())
+    return h.hexdigest()
 
 # ------------------ 앱 설정 ------------------
 st.set_page_config(page_title="EV 충전소 탐색기", layout="wide")
 st.title("🔌 전기차 충전소 위치 탐색기 (CSV 기반)")
 
-XLSX_PATH = "한국환경공단_전기차 충전소 위치 및 운영정보.xlsx"
-df_raw = load_data(XLSX_PATH)
+DATA_PATH = "chargers.parquet"
+data = load_data(DATA_PATH)
+df_raw = data.df
 
 # ------------------ 필터 UI ------------------
+# "전체"를 고른 항목은 None으로 두고 검색 시 필터를 건너뜀
 with st.sidebar:
     st.header("🔍 필터")
-    selected_connectors = st.multiselect("커넥터 타입 선택", ["전체"] + sorted(df_raw["충전기타입"].dropna().unique()), default=["전체"])
-    if "전체" in selected_connectors:
-        selected_connectors = df_raw["충전기타입"].dropna().unique()
+    selected_connectors = st.multiselect("커넥터 타입 선택", ["전체"] + list(df_raw["충전기타입"].cat.categories), default=["전체"])
+    selected_connectors = None if "전체" in selected_connectors else selected_connectors
 
-    selected_operators = st.multiselect("운영기관 선택", ["전체"] + sorted(df_raw["운영기관"].dropna().unique()), default=["전체"])
-    if "전체" in selected_operators:
-        selected_operators = df_raw["운영기관"].dropna().unique()
+    selected_operators = st.multiselect("운영기관 선택", ["전체"] + list(df_raw["운영기관"].cat.categories), default=["전체"])
+    selected_operators = None if "전체" in selected_operators else selected_operators
 
-    selected_places = st.multiselect("장소유형 선택", ["전체"] + sorted(df_raw["장소유형"].dropna().unique()), default=["전체"])
-    if "전체" in selected_places:
-        selected_places = df_raw["장소유형"].dropna().unique()
+    selected_places = st.multiselect("장소유형 선택", ["전체"] + list(df_raw["장소유형"].cat.categories), default=["전체"])
+    selected_places = None if "전체" in selected_places else selected_places
 
-    selected_access = st.multiselect("외부인 개방 여부 선택", ["전체"] + sorted(df_raw["이용가능여부"].dropna().unique()), default=["전체"])
-    if "전체" in selected_access:
-        selected_access = df_raw["이용가능여부"].dropna().unique()
+    selected_access = st.multiselect("외부인 개방 여부 선택", ["전체"] + list(df_raw["이용가능여부"].cat.categories), default=["전체"])
+    selected_access = None if "전체" in selected_access else selected_access
 
-    selected_speeds = st.multiselect("충전 속도 선택", ["전체"] + sorted(df_raw["충전속도"].dropna().unique()), default=["전체"])
-    if "전체" in selected_speeds:
-        selected_speeds = df_raw["충전속도"].dropna().unique()
+    selected_speeds = st.multiselect("충전 속도 선택", ["전체"] + list(df_raw["충전속도"].cat.categories), default=["전체"])
+    selected_speeds = None if "전체" in selected_speeds else selected_speeds
 
 # ------------------ 위치 설정 ------------------
 col1, col2 = st.columns([1, 2])
@@ -87,14 +270,19 @@ with col1:
     if mode == "주소 입력":
         address_in = st.text_input("주소", "서울 중구 세종대로 110")
         if st.button("📍 주소 검색"):
-            lat, lon = address_to_coords(address_in)
-            if lat is not None:
-                st.session_state["center_lat"] = lat
-                st.session_state["center_lon"] = lon
-                st.success("주소를 기준으로 내 위치가 갱신되었습니다.")
-                st.rerun()
+            try:
+                lat, lon = address_to_coords(address_in)
+            except GeopyError as e:
+                # 예외는 st.cache_data에 저장되지 않으므로 다음 검색에서 다시 시도됨
+                st.error(f"주소 검색 중 오류가 발생했습니다: {e}")
             else:
-                st.error("주소를 찾을 수 없습니다.")
+                if lat is not None:
+                    st.session_state["center_lat"] = lat
+                    st.session_state["center_lon"] = lon
+                    st.success("주소를 기준으로 내 위치가 갱신되었습니다.")
+                    st.rerun()
+                else:
+                    st.error("주소를 찾을 수 없습니다.")
         lat = st.session_state.get("center_lat", DEFAULT_LAT)
         lon = st.session_state.get("center_lon", DEFAULT_LNG)
     else:
@@ -106,16 +294,25 @@ with col1:
     radius_km = st.slider("검색 반경 (km)", 0.1, 10.0, 1.0, step=0.1)
 
     if st.button("🔍 충전소 검색"):
-        df = df_raw.copy()
-        df["거리_km"] = haversine_np(df["경도"], df["위도"], lon, lat)
-        df = df[
-            (df["운영기관"].isin(selected_operators)) &
-            (df["장소유형"].isin(selected_places)) &
-            (df["이용가능여부"].isin(selected_access)) &
-            (df["충전기타입"].isin(selected_connectors)) &
-            (df["충전속도"].isin(selected_speeds)) &
-            (df["거리_km"] <= radius_km)
-        ].sort_values("거리_km")
+        idx = bbox_candidates(data.sindex, lat, lon, radius_km)
+        df = df_raw.iloc[idx]
+        a = haversine_a_nb(
+            data.lon_rad[idx], data.lat_rad[idx], data.cos_lat[idx],
+            lon, lat, dist_buffer(len(idx))
+        )
+        mask = a <= radius_to_a(radius_km)
+        for col, selected in [
+            ("운영기관", selected_operators),
+            ("장소유형", selected_places),
+            ("이용가능여부", selected_access),
+            ("충전기타입", selected_connectors),
+            ("충전속도", selected_speeds),
+        ]:
+            if selected is not None:
+                mask &= isin_codes(df[col], selected)
+        # 결과 좌표는 float64로 되돌려 소수점 6자리로 표시 (float32 그대로면 37.56631851196289 처럼 출력됨)
+        # km 변환(arcsin/sqrt)은 반경 안에 남은 행에만 적용
+        df = df[mask].assign(거리_km=a_to_km(a[mask])).sort_values("거리_km").astype({"위도": np.float64, "경도": np.float64}).round({"위도": 6, "경도": 6})
 
         st.session_state.update(
             searched=True,
@@ -130,30 +327,14 @@ with col2:
     lon = st.session_state.get("center_lon", DEFAULT_LNG)
     df = st.session_state.get("results", pd.DataFrame())
 
-    m = folium.Map(location=[lat, lon], zoom_start=13)
-    marker_cluster = MarkerCluster().add_to(m)
-
-    for _, r in df.iterrows():
-        color = "green" if r["이용가능여부"] == "이용가능" else "orange" if r["이용가능여부"] == "이용자제한" else "red"
-        kakao_link = f"https://map.kakao.com/link/to/{r['충전소명']},{r['위도']},{r['경도']}"
-        naver_link = f"https://map.naver.com/v5/directions/{lat},{lon}/{r['위도']},{r['경도']}"
-        html = (
-            f"<b>{r['충전소명']}</b><br>{r['주소']}<br>"
-            f"⚡ 타입: {r['충전기타입']}<br>"
-            f"⚡ 속도: {r['충전속도']}<br>"
-            f"🏢 운영기관: {r['운영기관']}<br>"
-            f"🗺 장소유형: {r['장소유형']}<br>"
-            f"📍 거리: {r['거리_km']:.2f} km<br>"
-            f"✅ 상태: {r['이용가능여부']}<br><br>"
-            f"<a href='{kakao_link}' target='_blank'>🧭 카카오 길찾기</a><br>"
-            f"<a href='{naver_link}' target='_blank'>🧭 네이버 길찾기</a>"
-        )
-        folium.Marker(
-            [r["위도"], r["경도"]],
-            tooltip=r["충전소명"],
-            popup=folium.Popup(html, max_width=300),
-            icon=folium.Icon(color=color, icon="bolt", prefix="fa")
-        ).add_to(marker_cluster)
+    # 위치·반경·결과가 그대로면 세션에 둔 마커 데이터를 재사용 (지도 객체는 매번 새로 생성)
+    key = map_cache_key(lat, lon, st.session_state.get("radius"), df)
+    if st.session_state.get("marker_key") != key or "marker_payload" not in st.session_state:
+        st.session_state.update(marker_key=key, marker_payload=marker_payload(df, lat, lon))
+
+    # 원형 마커가 많을 때는 SVG 대신 canvas로 그림
+    m = folium.Map(location=[lat, lon], zoom_start=13, prefer_canvas=len(df) >= CLUSTER_MARKER_LIMIT)
+    add_charger_markers(m, st.session_state["marker_payload"])
 
     # 내 위치 마커 표시
     folium.Marker(
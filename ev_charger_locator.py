@@ -1,30 +1,131 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 import requests
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree # libxml2 기반 XML 파서 (표준 ElementTree보다 빠름)
 import folium
-from streamlit_folium import st_folium
+from folium.plugins import FastMarkerCluster
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from geopy.exc import GeopyError
 import time # RateLimiter 사용 시 필요할 수 있음
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
+from numba import njit
 
 # ------------------ 거리 계산 함수 ------------------
-# 위도(lat)와 경도(lon)를 이용하여 두 지점 간의 거리를 km 단위로 계산합니다 (Haversine 공식).
-def haversine_np(lon1, lat1, lon2, lat2):
-    R = 6371  # 지구 반지름 (km)
-    # 위도와 경도를 라디안 단위로 변환합니다.
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-    
-    # 위도 및 경도 차이 계산
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    
-    # Haversine 공식 적용
-    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
-    return 2 * R * np.arcsin(np.sqrt(a))
+R_KM = 6371.0  # 지구 반지름 (km)
+
+# 위도(lat)와 경도(lon)를 이용하여 각 충전소와 기준 지점 사이의 Haversine a 항을 계산합니다.
+# 거리 = 2R·asin(√a) 는 a에 대해 단조 증가하므로, 반경 비교와 정렬은 a만으로 할 수 있습니다.
+# (asin/sqrt는 반경 안에 남은 충전소에만 a_to_km으로 적용합니다.)
+# Numba로 컴파일하여 중간 배열 없이 한 번의 루프로 계산합니다.
+# (Streamlit은 세션마다 별도 스레드에서 실행되므로 parallel=True는 쓰지 않습니다. 스레딩 레이어에 따라
+#  동시 호출 시 프로세스가 중단될 수 있고, bbox 후보 수천 건 정도에는 스레드 오버헤드가 더 큽니다.)
+# 충전소 좌표는 데이터 로드 시 미리 계산해 둔 라디안 값과 cos(위도)를 받습니다.
+# 결과는 미리 할당된 out 배열에 기록됩니다.
+@njit(fastmath=True, cache=True)
+def haversine_a_nb(lon_r, lat_r, cos_lat, lon0, lat0, out):
+    # 기준 지점의 위도와 경도를 라디안 단위로 변환합니다.
+    lon0 = math.radians(lon0)
+    lat0 = math.radians(lat0)
+    cos_lat0 = math.cos(lat0)
+
+    for i in range(lon_r.size):
+        # Haversine 공식의 a 항
+        out[i] = math.sin((lat_r[i] - lat0) / 2) ** 2 + cos_lat0 * cos_lat[i] * math.sin((lon_r[i] - lon0) / 2) ** 2
+    return out
+
+# 검색 반경(km)에 해당하는 a 값 (a <= 이 값이면 반경 안)
+def radius_to_a(radius_km):
+    return math.sin(radius_km / (2 * R_KM)) ** 2
+
+# a 값을 km 단위 거리로 변환합니다.
+def a_to_km(a):
+    return 2 * R_KM * np.arcsin(np.sqrt(a))
+
+# 거리 계산 결과를 담을 버퍼를 세션 상태에 보관하여 검색할 때마다 새로 할당하지 않도록 합니다.
+def dist_buffer(n):
+    buf = st.session_state.get('dist_buf')
+    if buf is None or buf.size < n:
+        buf = np.empty(n, dtype=np.float64)
+        st.session_state['dist_buf'] = buf
+    return buf[:n]
+
+# 검색 반경을 감싸는 위경도 사각형(1도 ≈ 111km) 안의 충전소만 True로 표시합니다.
+# Haversine 계산 전에 이 값으로 후보를 먼저 추려 전체 데이터에 대한 삼각함수 계산을 피합니다.
+def bbox_mask(lat_arr, lon_arr, lat, lon, radius_km):
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.0 * math.cos(math.radians(lat)))
+    return (np.abs(lat_arr - lat) <= dlat) & (np.abs(lon_arr - lon) <= dlon)
 
 # ------------------ KEPCO API 호출 함수 ------------------
+PAGE_ROWS = 1000 # 한 페이지에 요청할 데이터 수 (API 최대값)
+MAX_FETCH_WORKERS = 8 # 여러 페이지를 동시에 요청할 스레드 수
+
+# API 호출에 사용할 HTTP 세션입니다. 앱 전체에서 하나를 공유하여 연결(keep-alive)을 재사용하고,
+# gzip 압축 응답을 요청하며, 일시적인 연결 오류는 지수 백오프로 최대 3회 재시도합니다.
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip"
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_FETCH_WORKERS, max_retries=Retry(total=3, backoff_factor=0.5))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# 한 페이지를 요청합니다. 워커 스레드에서 실행되므로 st.* 를 호출하지 않고 응답만 반환합니다.
+def fetch_page(session, base_url, params, page_no):
+    response = session.get(base_url, params={**params, "pageNo": page_no}, timeout=10)
+    # HTTP 오류 (4xx, 5xx) 발생 시 예외 발생
+    response.raise_for_status()
+    return response
+
+# 응답의 <items> 태그를 DataFrame으로 변환합니다.
+def items_to_df(items):
+    # 행마다 dict를 만들지 않고 컬럼별로 값을 모아 DataFrame을 한 번에 생성합니다.
+    # 좌표는 아이템 수만큼 미리 할당한 배열에 채우고, 나머지 문자열 컬럼은 리스트에 추가합니다.
+    item_list = items.findall("item")
+    lats = np.empty(len(item_list), dtype=np.float64)
+    lons = np.empty(len(item_list), dtype=np.float64)
+    names, addrs, use_times, operators, cp_types, cp_stats = [], [], [], [], [], []
+    n = 0 # 정상적으로 파싱된 아이템 수
+    for item in item_list:
+        try:
+            # float() 변환 시 None 대신 0을 기본값으로 사용 (유효하지 않은 좌표 처리)
+            lat = float(item.findtext("lat") or 0)
+            lng = float(item.findtext("longi") or 0)
+        except Exception as e:
+            # 개별 아이템 파싱 중 오류 발생 시 경고 및 해당 아이템 건너뛰기
+            st.warning(f"데이터 파싱 중 오류 발생: {e} - 일부 충전소 데이터가 누락될 수 있습니다.")
+            continue
+        lats[n] = lat
+        lons[n] = lng
+        # findtext 사용 시 기본값 ""을 주어 None 대신 빈 문자열 반환
+        names.append(item.findtext("csNm", ""))
+        addrs.append(item.findtext("addr", ""))
+        use_times.append(item.findtext("useTime", "정보없음"))
+        operators.append(item.findtext("busiNm", "정보없음"))
+        cp_types.append(item.findtext("cpTp", "정보없음")) # 충전기 타입 코드 (API 문서 참고)
+        cp_stats.append(item.findtext("cpStat", "정보없음")) # 충전기 상태 코드 (API 문서 참고)
+        n += 1
+
+    return pd.DataFrame({
+        "충전소명": names,
+        "주소": addrs,
+        "위도": lats[:n],
+        "경도": lons[:n],
+        "이용가능여부": use_times,
+        "운영기관": operators,
+        "충전기타입": cp_types,
+        "충전기상태": cp_stats,
+    })
+
 # @st.cache_data 데코레이터를 사용하여 API 호출 결과를 캐시합니다 (성능 개선 및 API 트래픽 관리).
 # 데이터는 1시간(3600초) 동안 캐시됩니다.
 @st.cache_data(ttl=3600) 
@@ -34,74 +135,72 @@ def fetch_ev_data_from_api(service_key: str) -> pd.DataFrame:
     # API End Point (공공데이터포털 문서를 기반으로 HTTP 사용으로 변경)
     base_url = "http://openapi.kepco.co.kr/service/EvInfoServiceV2/getEvSearchList" # HTTPS -> HTTP로 변경
     
-    # requests.get의 params 인자를 사용하여 파라미터를 전달합니다.
+    # params 인자를 사용하여 파라미터를 전달합니다.
     # 이 방식은 파라미터 값의 URL 인코딩을 requests 라이브러리가 자동으로 처리합니다.
     params = {
         "serviceKey": service_key,
-        "pageNo": 1,
-        "numOfRows": 1000, # 한 번에 최대 1000개의 데이터 요청 (API 정책에 따라 조정 가능)
+        "numOfRows": PAGE_ROWS, # 한 번에 최대 1000개의 데이터 요청 (API 정책에 따라 조정 가능)
         "addr": "" # 'addr' 파라미터는 필수 아니지만, 명시적으로 빈 문자열로 보내 오류 방지
     }
 
     try:
-        # API 호출 (타임아웃 10초 설정)
-        response = requests.get(base_url, params=params, timeout=10)
-        # HTTP 오류 (4xx, 5xx) 발생 시 예외 발생
-        response.raise_for_status() 
-
-        # XML 응답 파싱 및 API 응답 헤더 확인
-        root = ET.fromstring(response.content)
-        header = root.find("header")
-        result_code = header.findtext("resultCode", "N/A")
-        result_msg = header.findtext("resultMsg", "N/A")
-
-        # API 응답 코드가 '00' (정상)이 아닌 경우 오류 메시지 표시
-        if result_code != "00":
-            st.error(f"❌ API 응답 오류 (코드: {result_code}): {result_msg}")
-            st.code(response.text[:1000], language="xml") # 오류 응답의 일부를 보여줌
-            return pd.DataFrame()
-
-        # 'body/items' 태그에서 충전소 데이터 추출
-        items = root.find("body/items")
-        if items is None:
-            # resultCode가 '00'이지만 items가 없는 경우 (데이터 없음 또는 예상치 못한 구조)
-            st.warning("⚠️ API 응답에 유효한 <items> 태그가 없습니다. (데이터 없음 또는 응답 구조 변화 가능성)")
-            st.code(response.text[:1000], language="xml")
-            return pd.DataFrame()
-
-        data = []
-        for item in items.findall("item"):
-            try:
-                # findtext 사용 시 기본값 ""을 주어 None 대신 빈 문자열 반환
-                data.append({
-                    "충전소명": item.findtext("csNm", ""),
-                    "주소": item.findtext("addr", ""),
-                    # float() 변환 시 None 대신 0을 기본값으로 사용 (유효하지 않은 좌표 처리)
-                    "위도": float(item.findtext("lat") or 0),
-                    "경도": float(item.findtext("longi") or 0),
-                    "이용가능여부": item.findtext("useTime", "정보없음"),
-                    "운영기관": item.findtext("busiNm", "정보없음"),
-                    "충전기타입": item.findtext("cpTp", "정보없음"), # 충전기 타입 코드 (API 문서 참고)
-                    "충전기상태": item.findtext("cpStat", "정보없음") # 충전기 상태 코드 (API 문서 참고)
-                })
-            except Exception as e:
-                # 개별 아이템 파싱 중 오류 발생 시 경고 및 해당 아이템 건너뛰기
-                st.warning(f"데이터 파싱 중 오류 발생: {e} - 일부 충전소 데이터가 누락될 수 있습니다.")
-                continue
-
-        df = pd.DataFrame(data)
+        # 첫 페이지를 요청하여 전체 데이터 수(totalCount)를 확인합니다. (공유 세션 사용, 타임아웃 10초 설정)
+        session = get_http_session()
+        response = fetch_page(session, base_url, params, 1)
+        root = etree.fromstring(response.content)
+        total_count = int(root.findtext("body/totalCount") or 0)
+        n_pages = max(1, math.ceil(total_count / PAGE_ROWS))
+
+        # 나머지 페이지는 스레드로 동시에 요청합니다. (대부분 네트워크 대기 시간이므로 스레드로 충분)
+        responses = [response]
+        if n_pages > 1:
+            with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as ex:
+                responses += ex.map(lambda p: fetch_page(session, base_url, params, p), range(2, n_pages + 1))
+
+        # 응답 파싱과 메시지 표시는 메인 스레드에서 페이지 순서대로 처리합니다.
+        frames = []
+        for page_no, response in enumerate(responses, start=1):
+            if page_no > 1:
+                root = etree.fromstring(response.content)
+
+            # API 응답 헤더 확인
+            header = root.find("header")
+            result_code = header.findtext("resultCode", "N/A")
+            result_msg = header.findtext("resultMsg", "N/A")
+
+            # API 응답 코드가 '00' (정상)이 아닌 경우 오류 메시지 표시
+            if result_code != "00":
+                st.error(f"❌ API 응답 오류 (페이지 {page_no}, 코드: {result_code}): {result_msg}")
+                st.code(response.text[:1000], language="xml") # 오류 응답의 일부를 보여줌
+                return pd.DataFrame()
+
+            # 'body/items' 태그에서 충전소 데이터 추출
+            items = root.find("body/items")
+            if items is None:
+                # resultCode가 '00'이지만 items가 없는 경우 (데이터 없음 또는 예상치 못한 구조)
+                st.warning("⚠️ API 응답에 유효한 <items> 태그가 없습니다. (데이터 없음 또는 응답 구조 변화 가능성)")
+                st.code(response.text[:1000], language="xml")
+                return pd.DataFrame()
+            frames.append(items_to_df(items))
+
+        df = pd.concat(frames, ignore_index=True)
         # 위도/경도가 0인 데이터는 유효하지 않은 좌표로 간주하고 필터링합니다.
         df = df[(df['위도'] != 0) | (df['경도'] != 0)]
+        # 거리 계산에 쓰이는 라디안 좌표와 cos(위도)를 미리 계산해 캐시에 함께 저장합니다.
+        # (float32로도 약 1m 정밀도라 충분하며 메모리 사용량이 절반으로 줄어듭니다.)
+        lat_r = np.radians(df['위도'].to_numpy(np.float32))
+        df = df.assign(_lat_r=lat_r, _lon_r=np.radians(df['경도'].to_numpy(np.float32)), _cos_lat=np.cos(lat_r))
         st.success(f"✅ 총 {len(df)}개의 충전소 데이터를 성공적으로 불러왔습니다.")
         return df
 
     except requests.exceptions.RequestException as e:
         # API 호출 중 네트워크 또는 HTTP 오류 발생 시 처리
         st.error(f"❌ API 호출 중 네트워크 또는 HTTP 오류 발생: {e}")
-        st.write("API 요청 URL:", response.url if 'response' in locals() else base_url)
-        st.code(response.text if 'response' in locals() else "응답 없음", language="xml")
+        # 실패한 요청 기준으로 표시합니다. (다른 페이지를 요청하던 워커 스레드에서 발생했을 수 있음)
+        st.write("API 요청 URL:", e.request.url if e.request is not None else base_url)
+        st.code(e.response.text if e.response is not None else "응답 없음", language="xml")
         return pd.DataFrame()
-    except ET.ParseError as e:
+    except etree.XMLSyntaxError as e:
         # XML 파싱 오류 발생 시 처리 (API 응답이 올바른 XML 형식이 아닐 경우)
         st.error(f"❌ XML 파싱 실패: {e}. API 응답이 올바른 XML 형식이 아닐 수 있습니다.")
         st.code(response.text if 'response' in locals() else "응답 없음", language="xml")
@@ -112,26 +211,137 @@ def fetch_ev_data_from_api(service_key: str) -> pd.DataFrame:
         return pd.DataFrame()
 
 # ------------------ 주소 → 좌표 변환 함수 ------------------
+# 지오코딩 결과를 디스크에 저장하는 캐시입니다. 앱이 재시작되어도 유지되며 30일 후 만료됩니다.
+GEOCACHE_TTL = 30 * 86400
+
+# @st.cache_resource를 사용하여 캐시 디렉터리를 한 번만 열고 모든 세션이 공유합니다.
+@st.cache_resource
+def get_geocache():
+    return diskcache.Cache(".geocache")
+
+# Nominatim 지오코더와 RateLimiter를 한 번만 생성하여 모든 호출이 공유합니다.
+# RateLimiter는 마지막 요청 시각을 내부에 기억하므로, 호출마다 새로 만들면 요청 간 지연이 지켜지지 않습니다.
+@st.cache_resource
+def get_geocoder():
+    # Nominatim을 사용하여 주소를 좌표로 변환 (user_agent는 필수)
+    geolocator = Nominatim(user_agent="ev_charger_locator_app_streamlit") 
+    # RateLimiter를 사용하여 API 요청 간 최소 지연 시간을 설정 (API 정책 준수)
+    # 네트워크/서버 오류는 None으로 삼키지 않고 예외로 올려, '좌표 없음' 결과로 캐시되지 않도록 합니다.
+    return RateLimiter(geolocator.geocode, min_delay_seconds=1.5, swallow_exceptions=False)
+
 # @st.cache_data 데코레이터를 사용하여 주소-좌표 변환 결과를 캐시합니다 (성능 개선).
 # 주소-좌표 변환 결과는 24시간(86400초) 동안 캐시됩니다.
 @st.cache_data(ttl=86400) 
 def get_coordinates(address):
-    # Nominatim을 사용하여 주소를 좌표로 변환 (user_agent는 필수)
-    geolocator = Nominatim(user_agent="ev_charger_locator_app_streamlit") 
-    # RateLimiter를 사용하여 API 요청 간 최소 지연 시간을 설정 (API 정책 준수)
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1.5) 
+    geocode = get_geocoder()
+    # 디스크 캐시 키는 공백/대소문자를 정규화한 주소를 사용합니다.
+    cache = get_geocache()
+    key = address.strip().lower()
     
-    try:
-        # 주소 변환 (타임아웃 10초 설정)
+    # 지오코딩 오류(GeopyError)는 여기서 잡지 않습니다. 예외는 st.cache_data에 저장되지 않으므로
+    # 호출한 쪽에서 오류를 표시하고, 다음 검색 때 다시 시도됩니다.
+    coords = cache.get(key)
+    if coords is None:
+        # 캐시에 없을 때만 주소 변환 (타임아웃 10초 설정)
         location = geocode(address, timeout=10) 
         if location:
-            st.success(f"✅ '{address}'에 대한 좌표: 위도 {location.latitude}, 경도 {location.longitude}")
-            return location.latitude, location.longitude
-        st.error(f"❌ '{address}'에 대한 좌표를 찾을 수 없습니다. 주소를 다시 확인해주세요.")
-        return None, None
-    except Exception as e:
-        st.error(f"❌ 주소-좌표 변환 중 오류 발생: {e}. 주소가 정확한지 확인하거나 네트워크 연결을 확인하세요.")
-        return None, None
+            coords = (location.latitude, location.longitude)
+            cache.set(key, coords, expire=GEOCACHE_TTL)
+    if coords:
+        st.success(f"✅ '{address}'에 대한 좌표: 위도 {coords[0]}, 경도 {coords[1]}")
+        return coords
+    st.error(f"❌ '{address}'에 대한 좌표를 찾을 수 없습니다. 주소를 다시 확인해주세요.")
+    return None, None
+
+# ------------------ 지도 마커 템플릿 ------------------
+# 충전소 마커와 팝업은 브라우저에서 이 JavaScript 함수로 생성합니다 (FastMarkerCluster 콜백).
+# 파이썬에서 행마다 HTML 문자열을 만들지 않고, 한 번 정의한 템플릿 리터럴에 값만 채워 넣습니다.
+# row 순서: [위도, 경도, 충전소명, 주소, 충전기타입, 운영기관, 이용가능여부, 충전기상태, 거리_km]
+MARKER_CALLBACK = """function (row) {
+    // 팝업 HTML 내용 구성
+    var html = `<b>${row[2]}</b><br>${row[3]}<br>
+        ⚡ 타입: ${row[4]}<br>
+        🏢 운영기관: ${row[5]}<br>
+        🕒 이용시간: ${row[6]}<br>
+        🔌 상태: ${row[7]}<br>
+        📍 거리: ${row[8].toFixed(2)} km`;
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({markerColor: 'green', icon: 'bolt', prefix: 'fa'}) // 초록색 번개 아이콘
+    });
+    marker.bindTooltip(row[2]);
+    marker.bindPopup(html, {maxWidth: 300});
+    return marker;
+}"""
+
+# 검색 결과 수에 따라 지도에 마커를 그리는 방식을 바꿉니다.
+# - PLAIN_MARKER_LIMIT 미만: 클러스터 없이 일반 마커 (클러스터 초기화 비용이 더 큼)
+# - CLUSTER_MARKER_LIMIT 미만: FastMarkerCluster (브라우저에서 마커 생성)
+# - 그 이상: GeoJSON 원형 마커 레이어 (마커 아이콘 DOM 없이 canvas에 그림)
+PLAIN_MARKER_LIMIT = 50
+CLUSTER_MARKER_LIMIT = 2000
+
+# GeoJSON 속성 이름은 페이로드를 줄이기 위해 짧은 ASCII 키를 사용하고, 팝업에는 별칭으로 표시합니다.
+GEOJSON_FIELDS = {
+    '충전소명': 'name', '주소': 'addr', '충전기타입': 'type', '운영기관': 'op',
+    '이용가능여부': 'time', '충전기상태': 'stat', '거리_km': 'dist',
+}
+GEOJSON_ALIASES = ['충전소', '주소', '⚡ 타입', '🏢 운영기관', '🕒 이용시간', '🔌 상태', '📍 거리(km)']
+
+# DataFrame을 GeoJSON FeatureCollection(dict)으로 변환합니다.
+def df_to_geojson(df):
+    coords = np.column_stack([df['경도'].to_numpy(np.float64), df['위도'].to_numpy(np.float64)]).tolist()
+    props = df[list(GEOJSON_FIELDS)].rename(columns=GEOJSON_FIELDS).to_dict('records')
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': xy}, 'properties': p}
+            for xy, p in zip(coords, props)
+        ],
+    }
+
+# 일반 마커(결과가 적을 때)의 팝업 HTML 템플릿입니다.
+# 반복문 안에서 f-string을 매번 평가하지 않고, 미리 만든 템플릿에 행 dict를 채워 넣습니다 (str.format_map).
+POPUP_TMPL = (
+    "<b>{충전소명}</b><br>{주소}<br>"
+    "⚡ 타입: {충전기타입}<br>" # 충전기 타입 표시
+    "🏢 운영기관: {운영기관}<br>"
+    "🕒 이용시간: {이용가능여부}<br>"
+    "🔌 상태: {충전기상태}<br>" # 충전기 상태 표시
+    "📍 거리: {거리_km:.2f} km"
+).format_map
+
+# 주변 충전소 마커를 지도에 추가합니다.
+def add_charger_markers(m, nearby):
+    if len(nearby) < PLAIN_MARKER_LIMIT:
+        for row in nearby.itertuples(index=False):
+            # 팝업 HTML 내용 구성
+            popup_html = POPUP_TMPL(row._asdict())
+            folium.Marker(
+                [row.위도, row.경도],
+                popup=folium.Popup(popup_html, max_width=300),
+                tooltip=row.충전소명,
+                icon=folium.Icon(color='green', icon='bolt', prefix='fa') # 초록색 번개 아이콘
+            ).add_to(m)
+    elif len(nearby) < CLUSTER_MARKER_LIMIT:
+        # 행마다 folium.Marker를 만들지 않고 데이터만 넘겨 브라우저에서 마커/팝업을 생성합니다.
+        data = list(nearby[[
+            '위도', '경도', '충전소명', '주소', '충전기타입',
+            '운영기관', '이용가능여부', '충전기상태', '거리_km'
+        ]].itertuples(index=False, name=None))
+        FastMarkerCluster(data, callback=MARKER_CALLBACK).add_to(m)
+    else:
+        folium.GeoJson(
+            df_to_geojson(nearby.assign(거리_km=nearby['거리_km'].round(2))),
+            marker=folium.CircleMarker(radius=5, color='green', weight=1, fill=True, fill_color='green', fill_opacity=0.8),
+            tooltip=folium.GeoJsonTooltip(fields=['name'], labels=False),
+            popup=folium.GeoJsonPopup(fields=list(GEOJSON_FIELDS.values()), aliases=GEOJSON_ALIASES, max_width=300),
+        ).add_to(m)
+
+# 지도 HTML 캐시 키: 사용자 위치, 반경, 결과 행 인덱스가 같으면 같은 지도입니다.
+def map_cache_key(lat, lng, radius, nearby):
+    h = hashlib.md5(repr((lat, lng, radius)).encode())
+    h.update(nearby.index.to_numpy().tobytes())
+    return h.hexdigest()
 
 # ------------------ Streamlit 앱 시작 ------------------
 # 페이지 설정: 넓은 레이아웃 사용, 페이지 제목 설정
@@ -196,7 +406,10 @@ with col1: # 왼쪽 컬럼: 위치 설정 및 검색 컨트롤
         user_lat, user_lng = None, None
         if option == '주소 입력':
             # 주소 입력 시 좌표 변환 함수 호출
-            user_lat, user_lng = get_coordinates(address)
+            try:
+                user_lat, user_lng = get_coordinates(address)
+            except GeopyError as e:
+                st.error(f"❌ 주소-좌표 변환 중 오류 발생: {e}. 주소가 정확한지 확인하거나 네트워크 연결을 확인하세요.")
             if user_lat is None: # 좌표 변환 실패 시
                 st.session_state['searched'] = False # 검색 상태 초기화
                 st.stop() # 앱 실행 중단 또는 경고 메시지 표시 후 대기
@@ -205,18 +418,19 @@ with col1: # 왼쪽 컬럼: 위치 설정 및 검색 컨트롤
 
         # 유효한 좌표가 있을 때만 거리 계산 및 세션 상태 업데이트
         if user_lat is not None and user_lng is not None:
-            # DataFrame 복사본을 만들어 원본 데이터 보호
-            df_copy = df.copy()
+            # 검색 반경 사각형 안에 있는 후보 충전소의 행 위치
+            cand = np.flatnonzero(bbox_mask(df['위도'].values, df['경도'].values, user_lat, user_lng, radius))
             
-            # 모든 충전소와 사용자 위치 간의 거리 계산
-            dists = haversine_np(
-                df_copy['경도'].values, df_copy['위도'].values, # 충전소 경도/위도
-                np.full(len(df_copy), user_lng), np.full(len(df_copy), user_lat) # 사용자 경도/위도 배열
+            # 후보 충전소와 사용자 위치 간의 거리 계산 (DataFrame 전체를 복사하지 않고 좌표 배열만 사용)
+            a = haversine_a_nb(
+                df['_lon_r'].values[cand], df['_lat_r'].values[cand], df['_cos_lat'].values[cand], # 충전소 라디안 좌표
+                user_lng, user_lat, # 사용자 경도/위도
+                dist_buffer(len(cand))
             )
-            df_copy['거리_km'] = dists
             
-            # 검색 반경 내 충전소 필터링 및 거리 순 정렬
-            nearby = df_copy[df_copy['거리_km'] <= radius].sort_values('거리_km')
+            # 검색 반경 내 충전소만 꺼내 km 거리 컬럼을 붙이고 거리 순 정렬 (원본 데이터는 수정하지 않음)
+            within = a <= radius_to_a(radius)
+            nearby = df.iloc[cand[within]].assign(거리_km=a_to_km(a[within])).sort_values('거리_km')
 
             # 검색 결과 및 사용자 위치 정보를 세션 상태에 저장
             st.session_state.update({
@@ -245,47 +459,40 @@ with col2: # 오른쪽 컬럼: 지도 및 충전소 목록 표시
 
         st.subheader(f"🔍 반경 {radius:.1f}km 내 {len(nearby)}개 충전소")
 
-        # Folium 지도 초기화 (사용자 위치를 중심으로 설정)
-        m = folium.Map(location=[user_lat, user_lng], zoom_start=13)
-
-        # 사용자 위치 마커 추가
-        folium.Marker(
-            [user_lat, user_lng],
-            tooltip='내 위치',
-            icon=folium.Icon(color='blue', icon='user', prefix='fa') # 파란색 사용자 아이콘
-        ).add_to(m)
-
-        # 검색 반경을 원으로 표시 (km를 미터로 변환하여 Folium에 전달)
-        folium.Circle(
-            location=[user_lat, user_lng],
-            radius=radius * 1000, 
-            color='blue',
-            fill=True,
-            fill_color='blue',
-            fill_opacity=0.1,
-            tooltip=f"{radius:.1f} km 반경"
-        ).add_to(m)
+        # 위치·반경·결과 행이 그대로면 세션에 저장해 둔 지도 HTML을 다시 사용합니다.
+        # (다른 위젯만 조작해 재실행될 때 마커 생성과 Leaflet HTML 직렬화를 건너뜀)
+        key = map_cache_key(user_lat, user_lng, radius, nearby)
+        if st.session_state.get('map_key') != key or 'map_html' not in st.session_state:
+            # Folium 지도 초기화 (사용자 위치를 중심으로 설정)
+            # 원형 마커가 많을 때는 SVG 대신 canvas로 그려 브라우저 렌더링 부담을 줄입니다.
+            m = folium.Map(location=[user_lat, user_lng], zoom_start=13, prefer_canvas=len(nearby) >= CLUSTER_MARKER_LIMIT)
 
-        # 주변 충전소 마커 추가
-        for idx, row in nearby.iterrows():
-            # 팝업 HTML 내용 구성
-            popup_html = (
-                f"<b>{row['충전소명']}</b><br>{row['주소']}<br>"
-                f"⚡ 타입: {row['충전기타입']}<br>" # 충전기 타입 표시
-                f"🏢 운영기관: {row['운영기관']}<br>"
-                f"🕒 이용시간: {row['이용가능여부']}<br>"
-                f"🔌 상태: {row['충전기상태']}<br>" # 충전기 상태 표시
-                f"📍 거리: {row['거리_km']:.2f} km"
-            )
+            # 사용자 위치 마커 추가
             folium.Marker(
-                [row['위도'], row['경도']],
-                popup=folium.Popup(popup_html, max_width=300),
-                tooltip=row['충전소명'],
-                icon=folium.Icon(color='green', icon='bolt', prefix='fa') # 초록색 번개 아이콘
+                [user_lat, user_lng],
+                tooltip='내 위치',
+                icon=folium.Icon(color='blue', icon='user', prefix='fa') # 파란색 사용자 아이콘
             ).add_to(m)
 
-        # Streamlit에 Folium 맵 렌더링
-        st_folium(m, width=800, height=550)
+            # 검색 반경을 원으로 표시 (km를 미터로 변환하여 Folium에 전달)
+            folium.Circle(
+                location=[user_lat, user_lng],
+                radius=radius * 1000, 
+                color='blue',
+                fill=True,
+                fill_color='blue',
+                fill_opacity=0.1,
+                tooltip=f"{radius:.1f} km 반경"
+            ).add_to(m)
+
+            # 주변 충전소 마커 추가 (결과 수에 따라 일반 마커 / 클러스터 / GeoJSON 레이어)
+            add_charger_markers(m, nearby)
+
+            st.session_state['map_key'] = key
+            st.session_state['map_html'] = m.get_root().render()
+
+        # Streamlit에 Folium 맵 렌더링 (지도 클릭 값은 사용하지 않으므로 HTML만 표시)
+        components.html(st.session_state['map_html'], width=800, height=550)
 
         st.subheader("📋 충전소 목록")
         # 표시할 컬럼 선택 및 컬럼명 변경 후 데이터프레임 표시
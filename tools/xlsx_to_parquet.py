@@ -0,0 +1,25 @@
+"""한국환경공단 충전소 엑셀 파일을 app.py가 읽는 Parquet 파일로 변환합니다.
+
+엑셀(openpyxl) 파싱은 매우 느리므로 데이터가 갱신될 때 한 번만 실행합니다.
+
+    python tools/xlsx_to_parquet.py [원본.xlsx] [결과.parquet]
+"""
+import sys
+
+import pandas as pd
+
+XLSX_PATH = "한국환경공단_전기차 충전소 위치 및 운영정보.xlsx"
+PARQUET_PATH = "chargers.parquet"
+
+
+def main(xlsx_path: str = XLSX_PATH, parquet_path: str = PARQUET_PATH) -> None:
+    df = pd.read_excel(xlsx_path, engine="openpyxl")
+    # 숫자/문자가 섞인 열(예: 잘못 입력된 "위도경도")은 Parquet에 쓸 수 있도록 문자열로 통일
+    for col in df.select_dtypes("object").columns:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    df.to_parquet(parquet_path, compression="zstd", index=False)
+    print(f"{xlsx_path} → {parquet_path} ({len(df)}행)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])